@@ -1,24 +1,37 @@
 import base64
+import hashlib
 import os
-import dotenv
-import requests
-from typing import Dict, Any
+import httpx
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List
 from pathlib import Path
+from functools import lru_cache
+from dotenv import load_dotenv
 from app.logger import logging
-from dotenv import load_dotenv  
-import ssl
-import json
-import urllib.request
-dotenv.load_dotenv()
+from app.retry import http_retry
+load_dotenv()
 
-# Create a custom SSL context that ignores certificate verification
-ssl_context = ssl.create_default_context()
-ssl_context.check_hostname = False
-ssl_context.verify_mode = ssl.CERT_NONE
+SHA1_HEX_LENGTH = 40
+# TLS rules out sendfile(), so the body is copied through user space; large
+# reads keep the number of read syscalls and TLS writes per upload low
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def _iter_with_sha1(source: BinaryIO) -> Iterator[bytes]:
+    """Yield source in UPLOAD_CHUNK_SIZE chunks followed by their SHA1 hex digest,
+    for uploads sent with ``X-Bz-Content-Sha1: hex_digits_at_end``."""
+    sha1 = hashlib.sha1()
+    while chunk := source.read(UPLOAD_CHUNK_SIZE):
+        sha1.update(chunk)
+        yield chunk
+    yield sha1.hexdigest().encode()
+
+
+def _iter_slices(data: bytearray) -> Iterator[bytes]:
+    """Yield data in UPLOAD_CHUNK_SIZE slices, so sending a part never copies it whole."""
+    with memoryview(data) as view:
+        for start in range(0, len(view), UPLOAD_CHUNK_SIZE):
+            yield bytes(view[start:start + UPLOAD_CHUNK_SIZE])
 
-# Configure requests to use the custom SSL context
-requests.packages.urllib3.util.ssl_.DEFAULT_CIPHERS = 'ALL'
-requests.packages.urllib3.util.ssl_.create_default_context = lambda: ssl_context
 
 class B2Client:
     """Simplified B2 API client for file operations."""
@@ -26,6 +39,7 @@ class B2Client:
     def __init__(self):
         self.api_url = None
         self.auth_token = None
+        self.recommended_part_size = None
         self.bucket_id = os.getenv("B2_BUCKET_ID")
         self.bucket_name = os.getenv("B2_BUCKET")
         self.key_id = os.getenv("B2_USER")
@@ -36,6 +50,14 @@ class B2Client:
         logging.info(f"B2_USER: {'Set' if self.key_id else 'Not set'}")
         logging.info(f"B2_KEY: {'Set' if self.key else 'Not set'}")
 
+        # One pooled HTTP/2 client so repeated calls to the API and upload hosts
+        # reuse connections; certificates are verified against httpx's CA bundle
+        self.client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=8, max_connections=32),
+            timeout=30.0,
+        )
+
         # Authenticate on init
         self._authenticate()
 
@@ -51,16 +73,16 @@ class B2Client:
 
             logging.info("Authenticating with B2 API...")
             
-            response = requests.get(
+            response = self.client.get(
                 'https://api.backblazeb2.com/b2api/v2/b2_authorize_account',
-                headers=headers,
-                verify=False  # Disable SSL verification
+                headers=headers
             )
             response.raise_for_status()
             auth_data = response.json()
 
             self.api_url = auth_data['apiUrl']
             self.auth_token = auth_data['authorizationToken']
+            self.recommended_part_size = auth_data['recommendedPartSize']
             logging.info("Successfully authenticated with B2 API")
             
         except Exception as e:
@@ -70,67 +92,128 @@ class B2Client:
             raise
 
     def _get_upload_url(self) -> Dict[str, str]:
-        """Get an upload URL and authorization token."""
+        """Get an upload URL and authorization token. Not retried; callers retry the whole upload."""
+        logging.info("Getting B2 upload URL...")
+        data = self._call_api('b2_get_upload_url', {"bucketId": self.bucket_id})
+        logging.info("Successfully got B2 upload URL")
+        return {
+            'uploadUrl': data['uploadUrl'],
+            'authorizationToken': data['authorizationToken']
+        }
+
+    @http_retry
+    def _post_api(self, api_name: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Call a B2 API endpoint, retrying transient failures with backoff.
+
+        Calls made from inside an already retried upload operation use
+        _call_api instead, so retries are applied at one layer only.
+        """
+        return self._call_api(api_name, payload)
+
+    def _call_api(self, api_name: str, payload: Dict[str, Any], retry_auth: bool = True) -> Dict[str, Any]:
+        """Call a B2 API endpoint with the account auth token.
+
+        The token is cached for the life of the client, so an expired token
+        (401) triggers one re-authentication and retry.
+        """
         try:
             headers = {
                 'Authorization': self.auth_token,
                 'Content-Type': 'application/json'
             }
-
-            logging.info("Getting B2 upload URL...")
-            
-            response = requests.post(
-                f'{self.api_url}/b2api/v4/b2_get_upload_url',
+            response = self.client.post(
+                f'{self.api_url}/b2api/v4/{api_name}',
                 headers=headers,
-                json={"bucketId": self.bucket_id},
-                verify=False  # Disable SSL verification
+                json=payload
             )
+            if response.status_code == 401 and retry_auth:
+                logging.info(f"B2 rejected auth token for {api_name}, re-authenticating...")
+                self._authenticate()
+                return self._call_api(api_name, payload, retry_auth=False)
             response.raise_for_status()
-            data = response.json()
+            return response.json()
 
-            logging.info("Successfully got B2 upload URL")
-            return {
-                'uploadUrl': data['uploadUrl'],
-                'authorizationToken': data['authorizationToken']
-            }
-            
         except Exception as e:
-            logging.error(f"Failed to get B2 upload URL: {str(e)}")
-            if hasattr(e, 'response'):
+            logging.error(f"B2 call {api_name} failed: {str(e)}")
+            if hasattr(e, 'response') and e.response is not None:
                 logging.error(f"Response: {e.response.text}")
             raise
 
+    def _download_url(self, file_name: str) -> str:
+        """Public download URL for a file in the bucket."""
+        return f"https://media.sapphireapps.com/file/{self.bucket_name}/{file_name}"
+
+    @http_retry
     def upload_file(self, file_path: Path, file_name: str) -> str:
         """Upload file to B2."""
+        def send() -> str:
+            # Hand the open file to httpx so it is streamed, not read into memory
+            with open(file_path, "rb") as f:
+                size = file_path.stat().st_size
+                return self._upload(
+                    _iter_with_sha1(f), size + SHA1_HEX_LENGTH, "hex_digits_at_end", file_name
+                )
+
+        return self._upload_reauthenticating(send, file_name)
+
+    @http_retry
+    def upload_bytes(self, data: bytearray, file_name: str) -> str:
+        """Upload an in-memory buffer to B2 without copying it."""
+        sha1 = hashlib.sha1(data).hexdigest()
+        return self._upload_reauthenticating(
+            lambda: self._upload(_iter_slices(data), len(data), sha1, file_name), file_name
+        )
+
+    def _upload_reauthenticating(self, send: Callable[[], str], file_name: str) -> str:
+        """Run an upload, re-authenticating and sending once more if B2 rejects the token.
+
+        send must build a fresh request body on every call.
+        """
+        try:
+            try:
+                return send()
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 401:
+                    raise
+                logging.info(f"B2 rejected upload token for {file_name}, re-authenticating...")
+                self._authenticate()
+
+            return send()
+
+        except Exception as e:
+            logging.error(f"Unexpected error uploading file {file_name}: {str(e)}")
+            raise
+
+    def _upload(self, body: Iterable[bytes], content_length: int, sha1: str, file_name: str) -> str:
+        """Send body to B2 as file_name in a single request.
+
+        sha1 is the value of ``X-Bz-Content-Sha1``: either the hex digest, or
+        ``hex_digits_at_end`` when body appends it itself (see _iter_with_sha1)
+        and content_length includes those 40 digits.
+        """
         try:
             # Get upload URL and auth token
             upload_creds = self._get_upload_url()
             upload_url = upload_creds['uploadUrl']
             auth_token = upload_creds['authorizationToken']
 
-            # Read file content
-            with open(file_path, "rb") as f:
-                file_content = f.read()
-            
-            file_size = len(file_content)
-            logging.info(f"Uploading file: {file_name}, Size: {file_size} bytes")
+            logging.info(f"Uploading file: {file_name}, Size: {content_length} bytes")
             
             # Prepare headers for upload
             headers = {
                 "Authorization": auth_token,
                 "Content-Type": "application/octet-stream",
-                "Content-Length": str(file_size),
+                "Content-Length": str(content_length),
                 "X-Bz-File-Name": file_name,
-                "X-Bz-Content-Sha1": "do_not_verify",
+                "X-Bz-Content-Sha1": sha1,
                 "X-Bz-Info-Author": "zip_service"
             }
             
             # Upload file
-            upload_response = requests.post(
+            upload_response = self.client.post(
                 upload_url,  # Use the upload URL directly
                 headers=headers,
-                data=file_content,
-                verify=False  # Disable SSL verification
+                content=body
             )
             
             if upload_response.status_code != 200:
@@ -138,20 +221,180 @@ class B2Client:
                 logging.error(f"Response: {upload_response.text}")
                 upload_response.raise_for_status()
             
-            result = upload_response.json()
             logging.info(f"Successfully uploaded file {file_name} to B2")
             
             # Construct download URL
-            download_url = f"https://media.sapphireapps.com/file/{self.bucket_name}/{file_name}"
+            download_url = self._download_url(file_name)
             logging.info(f"Download URL: {download_url}")
             
             return download_url
             
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logging.error(f"Failed to upload file {file_name} to B2: {str(e)}")
             if hasattr(e, 'response') and e.response:
                 logging.error(f"Error response: {e.response.text}")
             raise
+
+    def open_upload_stream(self, file_name: str) -> "B2UploadStream":
+        """Open a writable stream that uploads to B2 as data is written."""
+        return B2UploadStream(self, file_name)
+
+    def _start_large_file(self, file_name: str) -> str:
+        """Start a large file upload and return its file ID."""
+        logging.info(f"Starting B2 large file upload for {file_name}")
+        data = self._post_api('b2_start_large_file', {
+            "bucketId": self.bucket_id,
+            "fileName": file_name,
+            "contentType": "application/octet-stream",
+            "fileInfo": {"author": "zip_service"}
+        })
+        return data['fileId']
+
+    def _get_upload_part_url(self, file_id: str) -> Dict[str, str]:
+        """Get an upload URL and authorization token for the parts of a large file.
+
+        Not retried; callers retry the whole part upload.
+        """
+        data = self._call_api('b2_get_upload_part_url', {"fileId": file_id})
+        return {
+            'uploadUrl': data['uploadUrl'],
+            'authorizationToken': data['authorizationToken']
+        }
+
+    def _upload_part(self, upload_creds: Dict[str, str], part_number: int, data: bytearray) -> str:
+        """Upload one part of a large file and return its SHA1."""
+        sha1 = hashlib.sha1(data).hexdigest()
+        headers = {
+            "Authorization": upload_creds['authorizationToken'],
+            "Content-Length": str(len(data)),
+            "X-Bz-Part-Number": str(part_number),
+            "X-Bz-Content-Sha1": sha1
+        }
+        logging.info(f"Uploading part {part_number}, Size: {len(data)} bytes")
+        response = self.client.post(
+            upload_creds['uploadUrl'],
+            headers=headers,
+            content=_iter_slices(data)
+        )
+        if response.status_code != 200:
+            logging.error(f"Part {part_number} upload failed with status {response.status_code}")
+            logging.error(f"Response: {response.text}")
+            response.raise_for_status()
+        return sha1
+
+    def _finish_large_file(self, file_id: str, part_sha1s: List[str]) -> None:
+        """Assemble the uploaded parts into the final file."""
+        self._post_api('b2_finish_large_file', {
+            "fileId": file_id,
+            "partSha1Array": part_sha1s
+        })
+
+    def _cancel_large_file(self, file_id: str) -> None:
+        """Cancel a large file upload and discard its uploaded parts."""
+        self._post_api('b2_cancel_large_file', {"fileId": file_id})
+
+
+@lru_cache(maxsize=1)
+def get_b2_client() -> B2Client:
+    """Return the process-wide B2Client, authenticated once and reused across tasks."""
+    return B2Client()
+
+
+class B2UploadStream:
+    """Writable file-like object that uploads to B2 while it is written.
+
+    Writes are buffered until a full part (B2's recommended part size) is
+    available and then sent with the large file API. A stream that ends
+    before the first part fills up is sent as a regular single upload.
+    """
+
+    def __init__(self, client: B2Client, file_name: str):
+        self.client = client
+        self.file_name = file_name
+        self.part_size = client.recommended_part_size
+        self.download_url = None
+        self._buffer = bytearray()
+        self._file_id = None
+        self._upload_creds = None
+        self._part_sha1s: List[str] = []
+        self._error = None
+
+    def write(self, data: bytes) -> int:
+        if self._error is not None:
+            # The upload already failed; swallow further writes (e.g. the zip's
+            # central directory) so they neither start new parts nor mask the error
+            return len(data)
+        self._buffer += data
+        # Only flush while more than a part is buffered, so close() always has a
+        # final part left and a large file never ends up with a single part.
+        while len(self._buffer) > self.part_size:
+            # Move the small overflow into a new buffer and truncate this one in
+            # place, so the part is never held in memory twice
+            part = self._buffer
+            self._buffer = part[self.part_size:]
+            del part[self.part_size:]
+            self._send_part(part)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def _send_part(self, part: bytearray) -> None:
+        try:
+            if self._file_id is None:
+                self._file_id = self.client._start_large_file(self.file_name)
+            part_number = len(self._part_sha1s) + 1
+            self._part_sha1s.append(self._upload_part(part_number, part))
         except Exception as e:
-            logging.error(f"Unexpected error uploading file {file_name}: {str(e)}")
+            self._error = e
+            self._buffer = bytearray()
+            raise
+
+    @http_retry
+    def _upload_part(self, part_number: int, part: bytearray) -> str:
+        # B2 expects a new part URL after a failed part upload, so drop the
+        # cached one on error and let the retry fetch a fresh one
+        if self._upload_creds is None:
+            self._upload_creds = self.client._get_upload_part_url(self._file_id)
+        try:
+            return self.client._upload_part(self._upload_creds, part_number, part)
+        except Exception:
+            self._upload_creds = None
             raise
+
+    def close(self) -> str:
+        """Send the remaining data and finish the upload. Returns the download URL."""
+        if self.download_url is not None:
+            return self.download_url
+        if self._error is not None:
+            raise RuntimeError(f"Upload of {self.file_name} already failed") from self._error
+
+        if self._file_id is None:
+            data, self._buffer = self._buffer, bytearray()
+            self.download_url = self.client.upload_bytes(data, self.file_name)
+        else:
+            if self._buffer:
+                part, self._buffer = self._buffer, bytearray()
+                self._send_part(part)
+            self.client._finish_large_file(self._file_id, self._part_sha1s)
+            logging.info(f"Successfully uploaded large file {self.file_name} in {len(self._part_sha1s)} parts")
+            self.download_url = self.client._download_url(self.file_name)
+        return self.download_url
+
+    def abort(self) -> None:
+        """Drop buffered data and cancel any parts already sent."""
+        self._buffer.clear()
+        if self._file_id is not None:
+            try:
+                self.client._cancel_large_file(self._file_id)
+            except Exception as e:
+                logging.error(f"Failed to cancel large file {self.file_name}: {str(e)}")
+
+    def __enter__(self) -> "B2UploadStream":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -22,6 +22,7 @@ celery_app.conf.update(
     task_track_started=True,
     task_time_limit=30 * 60,  # 30 minutes
     task_soft_time_limit=25 * 60,  # 25 minutes
-    worker_prefetch_multiplier=1,
-    worker_max_tasks_per_child=1000,
+    worker_prefetch_multiplier=1,  # Reserve one task at a time; each can move GBs of video
+    task_acks_late=True,  # Ack only after the task finishes
+    worker_max_tasks_per_child=100,
 )
@@ -0,0 +1,28 @@
+import httpx
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+from app.logger import logging
+
+
+def is_retryable_http_error(exc: BaseException) -> bool:
+    """Transport failures, 429s and 5xx responses are worth another attempt."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        status_code = exc.response.status_code
+        return status_code == 429 or status_code >= 500
+    return isinstance(exc, httpx.TransportError)
+
+
+def _log_retry(retry_state) -> None:
+    logging.warning(
+        f"Retrying {retry_state.fn.__name__} after attempt {retry_state.attempt_number} failed: "
+        f"{retry_state.outcome.exception()}"
+    )
+
+
+# Jittered exponential backoff for HTTP calls, re-raising the last error once attempts run out
+http_retry = retry(
+    retry=retry_if_exception(is_retryable_http_error),
+    wait=wait_random_exponential(min=1, max=30),
+    stop=stop_after_attempt(4),
+    before_sleep=_log_retry,
+    reraise=True,
+)
@@ -1,20 +1,114 @@
+import os
+import shutil
 import tempfile
+import threading
 from types import NoneType
 import zipfile
 from pathlib import Path
-from typing import List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Coroutine, List, Optional, Set, TypeVar
+import aiofiles
 import httpx
 import asyncio
+from celery.signals import worker_process_init, worker_process_shutdown
 from app.celery_app import celery_app
-from app.b2_client import B2Client
+from app.b2_client import get_b2_client
 from app.logger import logging
+from app.retry import http_retry
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+MAX_CONCURRENT_DOWNLOADS = 16
+ZIP_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+WARM_UP_TIMEOUT = 5.0
+CANCEL_TIMEOUT = 5.0
+
+T = TypeVar("T")
+
+# Event loop kept alive for the life of the worker process, so tasks do not
+# pay for creating and tearing down a loop each time
+_loop: Optional[asyncio.AbstractEventLoop] = None
+# Download client living on that loop, so DNS results, TLS sessions and open
+# connections carry over from one task to the next
+_http_client: Optional[httpx.AsyncClient] = None
+# Origins _http_client has already been warmed up for
+_warmed_origins: Set[str] = set()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the worker's background event loop, starting it on first use."""
+    global _loop
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+        threading.Thread(target=_loop.run_forever, name="async-io", daemon=True).start()
+    return _loop
+
+
+@worker_process_init.connect
+def start_event_loop(**kwargs) -> None:
+    # Start the loop in each forked child, never in the parent before the fork
+    get_event_loop()
+
+
+def run_async(coro: Coroutine[Any, Any, T]) -> T:
+    """Run a coroutine on the worker's event loop and wait for its result.
+
+    If the wait is interrupted (e.g. Celery's SoftTimeLimitExceeded), the
+    coroutine is cancelled and given a moment to unwind before re-raising,
+    as asyncio.run would do. If the loop had not started it yet, it is
+    closed instead and nothing is waited for.
+    """
+    loop = get_event_loop()
+    # Unlike run_coroutine_threadsafe's, this future is marked running once the
+    # task exists, so cancel() only succeeds while the coroutine is unstarted
+    future: Future = Future()
+    task: Optional[asyncio.Task] = None
+
+    def start() -> None:
+        nonlocal task
+        if not future.set_running_or_notify_cancel():
+            return
+        task = loop.create_task(coro)
+        task.add_done_callback(finish)
+
+    def finish(task: asyncio.Task) -> None:
+        if task.cancelled():
+            future.set_exception(asyncio.CancelledError())
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    loop.call_soon_threadsafe(start)
+    try:
+        return future.result()
+    except BaseException:
+        if future.cancel():
+            coro.close()
+        else:
+            # start() has run by the time this callback does, so task is set
+            loop.call_soon_threadsafe(lambda: task.cancel())
+            wait([future], timeout=CANCEL_TIMEOUT)
+        raise
+
+
+@worker_process_shutdown.connect
+def stop_event_loop(**kwargs) -> None:
+    # Close pooled connections on the loop that owns them, then stop the loop
+    global _http_client, _loop
+    if _loop is None:
+        return
+    if _http_client is not None:
+        run_async(_http_client.aclose())
+        _http_client = None
+    _loop.call_soon_threadsafe(_loop.stop)
+    _loop = None
 
 
 @celery_app.task(bind=True)
 def download_and_upload_videos(
     self, urls: List[str], webhook_url: Optional[str] = None,unique_id: str = None,type=None
 ):
-    """Download videos from URLs, zip them, upload to B2, and call webhook."""
+    """Download videos from URLs, zip them (unless there is only one), upload to B2, and call webhook."""
     try:
         logging.info(f"Task {self.request.id}: Starting download for URLs: {urls}")
         with tempfile.TemporaryDirectory() as temp_dir:
@@ -22,31 +116,30 @@ def download_and_upload_videos(
             download_dir = temp_path / "downloads"
             download_dir.mkdir()
 
-            # Download videos
-            downloaded_files = asyncio.run(download_videos(urls, download_dir))
-
-            # Check download results
-            if not downloaded_files:
-                failed_count = len(urls)
-                error_msg = f"No videos were successfully downloaded (Failed: {failed_count}/{len(urls)})"
-                logging.error(f"Task {self.request.id}: {error_msg}")
-                raise ValueError(error_msg)
-
-            # Continue with successful downloads
-            logging.info(
-                f"Task {self.request.id}: Successfully downloaded {len(downloaded_files)}/{len(urls)} files. "
-                "Creating zip."
-            )
-            zip_path = temp_path / f"{unique_id}.zip"
-            create_zip(downloaded_files, zip_path)
-
-            # Verify zip file
-            if not zip_path.exists() or zip_path.stat().st_size == 0:
-                raise ValueError("Created zip file is empty or does not exist")
-
-            logging.info(f"Task {self.request.id}: Uploading zip to B2.")
-            b2_url = B2Client().upload_file(zip_path, f"{unique_id}.zip")
-    
+            if len(urls) == 1:
+                # A single video needs no archive, upload it as-is
+                downloaded_files = run_async(download_videos(urls, download_dir))
+                check_downloads(self.request.id, urls, downloaded_files)
+                logging.info(f"Task {self.request.id}: Uploading video to B2.")
+                b2_url = get_b2_client().upload_file(downloaded_files[0], f"{unique_id}.mp4")
+            else:
+                # Zip each video on a worker thread as soon as it is downloaded, writing
+                # the archive straight into the B2 upload, so zipping and uploading
+                # overlap with the downloads that are still running
+                logging.info(f"Task {self.request.id}: Streaming zip to B2 while downloading.")
+                with get_b2_client().open_upload_stream(f"{unique_id}.zip") as upload:
+                    with zipfile.ZipFile(upload, "w", zipfile.ZIP_STORED, allowZip64=True) as zipf, \
+                            ThreadPoolExecutor(max_workers=1) as zipper:
+                        try:
+                            downloaded_files = run_async(download_and_zip(urls, download_dir, zipf, zipper))
+                        except BaseException:
+                            # Drop queued zip jobs; only the one already running is waited for
+                            zipper.shutdown(cancel_futures=True)
+                            raise
+                        check_downloads(self.request.id, urls, downloaded_files)
+                b2_url = upload.download_url
+                logging.info(f"Task {self.request.id}: Zipped and uploaded {len(downloaded_files)} files.")
+
             result = {
                 "unique_id": unique_id,
                 "type": type,
@@ -68,98 +161,253 @@ def download_and_upload_videos(
         raise
 
 
-async def download_videos(urls: List[str], download_dir: Path) -> List[Path]:
-    """Download videos in parallel batches using httpx."""
+def check_downloads(task_id: str, urls: List[str], downloaded_files: List[Path]) -> None:
+    """Fail the task when none of the videos could be downloaded."""
+    if not downloaded_files:
+        failed_count = len(urls)
+        error_msg = f"No videos were successfully downloaded (Failed: {failed_count}/{len(urls)})"
+        logging.error(f"Task {task_id}: {error_msg}")
+        raise ValueError(error_msg)
+
+    logging.info(f"Task {task_id}: Successfully downloaded {len(downloaded_files)}/{len(urls)} files.")
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the pooled HTTP/2 client shared by all downloads in this worker.
+
+    Must be called from the worker's event loop, which owns the connections.
+    """
+    global _http_client
+    if _http_client is None:
+        _http_client = build_http_client()
+        _warmed_origins.clear()
+    return _http_client
+
+
+def build_http_client() -> httpx.AsyncClient:
+    """Create the pooled HTTP/2 download client."""
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_keepalive_connections=32,
+            max_connections=64,
+            keepalive_expiry=60,
+        ),
+        timeout=30.0,
+        follow_redirects=True,
+    )
+
+
+async def download_videos(
+    urls: List[str], download_dir: Path, on_downloaded: Optional[Callable[[Path], None]] = None
+) -> List[Path]:
+    """Download videos concurrently over a shared httpx client.
+
+    on_downloaded, if given, is called with each file as soon as it finishes.
+    """
     downloaded_files = []
     logging.info(f"Starting download of {len(urls)} videos to {download_dir}")
 
-    async def download_video(url: str) -> Optional[Path]:
-        try:
-            logging.info(f"Attempting to download video from: {url}")
-            async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-                head_response = await client.head(url)
-                content_type = head_response.headers.get('content-type', '')
-                content_length = head_response.headers.get('content-length', 'unknown')
-                logging.info(f"URL headers - Content-Type: {content_type}, Size: {content_length} bytes")
-
-                # Get the actual content
-                response = await client.get(url)
-                response.raise_for_status()
-
-                if not response.content:
-                    logging.error(f"No content received from {url}")
-                    return None
-
-                filename = url.split("/")[-1]
-                if not filename.endswith((".mp4", ".MP4")):
-                    filename += ".mp4"
-
-                file_path = download_dir / filename
-                
-                # Log the file size before writing
-                content_size = len(response.content)
-                logging.info(f"Received {content_size} bytes for {filename}")
-
-                with open(file_path, "wb") as f:
-                    f.write(response.content)
-
-                # Verify the file was written correctly
-                if file_path.exists():
-                    file_size = file_path.stat().st_size
-                    if file_size > 0:
-                        logging.info(f"Successfully downloaded {filename} ({file_size} bytes)")
-                        return file_path
-                    else:
-                        logging.error(f"File was created but is empty: {filename}")
-                        return None
-                else:
-                    logging.error(f"Failed to create file: {filename}")
-                    return None
-
-        except httpx.TimeoutException as e:
-            logging.error(f"Timeout downloading {url}: {e}")
-            return None
-        except httpx.HTTPStatusError as e:
-            logging.error(f"HTTP error downloading {url}: {e.response.status_code} - {e}")
-            return None
-        except httpx.RequestError as e:
-            logging.error(f"Request error downloading {url}: {e}")
-            return None
-        except Exception as e:
-            logging.error(f"Unexpected error downloading {url}: {e}")
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+    client = get_http_client()
+    # The client outlives the task; don't let cookies set by one task's URLs
+    # be sent on requests made for another task
+    client.cookies.clear()
+    await warm_up(client, urls)
+
+    # A semaphore instead of fixed batches keeps slots busy: a slow download
+    # no longer holds back the start of the next ones. Each URL gets its own
+    # directory, so URLs ending in the same file name don't write the same file.
+    results = await asyncio.gather(
+        *[
+            download_video(client, url, download_dir / str(index), semaphore, on_downloaded)
+            for index, url in enumerate(urls)
+        ],
+        return_exceptions=True
+    )
+    for url, result in zip(urls, results):
+        if isinstance(result, BaseException):
+            logging.error(f"Error downloading {url}: {result}")
+        elif result is not None:
+            downloaded_files.append(result)
+
+    logging.info(f"Download complete. Total successful downloads: {len(downloaded_files)}/{len(urls)}")
+    return downloaded_files
+
+
+async def download_and_zip(
+    urls: List[str], download_dir: Path, zipf: zipfile.ZipFile, zipper: ThreadPoolExecutor
+) -> List[Path]:
+    """Download videos and add each one to zipf on the zipper thread as soon as it lands.
+
+    The first failed zip job (which includes uploading the archive) cancels the
+    remaining downloads and its error is raised.
+    """
+    loop = asyncio.get_running_loop()
+    zip_jobs: List[asyncio.Future] = []
+
+    def on_zipped(job: asyncio.Future) -> None:
+        if not job.cancelled() and job.exception() is not None:
+            downloads.cancel()
+
+    def on_downloaded(file_path: Path) -> None:
+        job = loop.run_in_executor(zipper, add_to_zip, zipf, file_path)
+        job.add_done_callback(on_zipped)
+        zip_jobs.append(job)
+
+    downloads = asyncio.ensure_future(download_videos(urls, download_dir, on_downloaded))
+    try:
+        downloaded_files = await downloads
+    except asyncio.CancelledError:
+        failed = [job for job in zip_jobs if job.done() and not job.cancelled() and job.exception()]
+        if failed:
+            raise failed[0].exception()
+        raise
+
+    # Raises the first zip error, if one happened after the last download
+    await asyncio.gather(*zip_jobs)
+    return downloaded_files
+
+
+async def download_video(
+    client: httpx.AsyncClient,
+    url: str,
+    download_dir: Path,
+    semaphore: asyncio.Semaphore,
+    on_downloaded: Optional[Callable[[Path], None]] = None,
+) -> Optional[Path]:
+    """Download a single video into download_dir using the shared client."""
+    async with semaphore:
+        file_path = await _download_video(client, url, download_dir)
+    if file_path is not None and on_downloaded is not None:
+        on_downloaded(file_path)
+    return file_path
+
+
+async def _download_video(client: httpx.AsyncClient, url: str, download_dir: Path) -> Optional[Path]:
+    try:
+        logging.info(f"Attempting to download video from: {url}")
+        filename = url.split("/")[-1]
+        if not filename.endswith((".mp4", ".MP4")):
+            filename += ".mp4"
+
+        download_dir.mkdir(exist_ok=True)
+        file_path = download_dir / filename
+
+        file_size = await fetch_to_file(client, url, file_path)
+
+        # Verify something was written, counting bytes rather than stat()-ing on the event loop
+        if file_size > 0:
+            logging.info(f"Successfully downloaded {filename} ({file_size} bytes)")
+            return file_path
+        else:
+            logging.error(f"File was created but is empty: {filename}")
             return None
 
-    batch_size = 4
-    for i in range(0, len(urls), batch_size):
-        batch = urls[i : i + batch_size]
-        logging.info(f"Processing batch {i//batch_size + 1} of {(len(urls) + batch_size - 1)//batch_size}")
+    except httpx.TimeoutException as e:
+        logging.error(f"Timeout downloading {url}: {e}")
+        return None
+    except httpx.HTTPStatusError as e:
+        logging.error(f"HTTP error downloading {url}: {e.response.status_code} - {e}")
+        return None
+    except httpx.RequestError as e:
+        logging.error(f"Request error downloading {url}: {e}")
+        return None
+    except Exception as e:
+        logging.error(f"Unexpected error downloading {url}: {e}")
+        return None
+
+
+@http_retry
+async def fetch_to_file(client: httpx.AsyncClient, url: str, file_path: Path) -> int:
+    """Stream url into file_path and return the number of bytes written.
+
+    Transient errors are retried; each attempt rewrites the file from the start.
+    """
+    # Stream the body straight to disk instead of buffering it in memory
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+        content_type = response.headers.get('content-type', '')
+        content_length = response.headers.get('content-length', 'unknown')
+        logging.info(f"URL headers - Content-Type: {content_type}, Size: {content_length} bytes")
+
+        # aiofiles runs the writes in a thread so other downloads keep reading
+        # from their sockets while this one is flushing to disk
+        file_size = 0
+        async with aiofiles.open(file_path, "wb") as f:
+            # The length is only the final size when the body is not content-encoded
+            if content_length.isdigit() and 'content-encoding' not in response.headers:
+                await asyncio.to_thread(preallocate, f.fileno(), int(content_length))
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                file_size += await f.write(chunk)
+    return file_size
+
+
+def preallocate(fd: int, size: int) -> None:
+    """Reserve size bytes for fd up front so the filesystem can allocate the file
+    in one go instead of growing it extent by extent while chunks arrive."""
+    if not hasattr(os, "posix_fallocate") or size <= 0:
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError as e:
+        logging.warning(f"Could not preallocate {size} bytes: {e}")
+
+
+async def warm_up(client: httpx.AsyncClient, urls: List[str]) -> None:
+    """Open a pooled connection to each host the worker has not contacted yet.
+
+    Without this, the first concurrent requests to a new host race to open
+    their own connections instead of sharing one HTTP/2 connection. Hosts
+    seen by earlier tasks are skipped, since the persistent client already
+    holds (or will quickly reopen) a connection to them.
+    """
+    origins = set()
+    for url in urls:
+        try:
+            origins.add(str(httpx.URL(url).join("/")))
+        except httpx.InvalidURL:
+            # Not fatal here: _download_video reports it as a failed download
+            continue
+    origins -= _warmed_origins
+    _warmed_origins.update(origins)
+
+    async def ping(origin: str) -> None:
         try:
-            results = await asyncio.gather(
-                *[download_video(url) for url in batch],
-                return_exceptions=False
-            )
-            successful_downloads = [f for f in results if f is not None]
-            logging.info(f"Batch completed. Successfully downloaded: {len(successful_downloads)}/{len(batch)}")
-            downloaded_files.extend(successful_downloads)
+            await client.head(origin, follow_redirects=False, timeout=WARM_UP_TIMEOUT)
         except Exception as e:
-            logging.error(f"Error processing batch: {e}")
+            # Best effort only; e.g. a URL with no scheme raises ValueError from
+            # the cookie jar. The download itself reports the real failure.
+            logging.warning(f"Connection warm-up to {origin} failed: {e}")
 
-    logging.info(f"Download complete. Total successful downloads: {len(downloaded_files)}/{len(urls)}")
-    return downloaded_files
+    await asyncio.gather(*[ping(origin) for origin in origins])
 
 
-def create_zip(files: List[Path], zip_path: Path) -> None:
-    """Create a zip file from the downloaded videos."""
+def add_to_zip(zipf: zipfile.ZipFile, file_path: Path) -> None:
+    """Add a downloaded video to an open zip archive."""
     try:
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for file_path in files:
-                zipf.write(file_path, file_path.name)
-        logging.info(f"Created zip file at {zip_path} with {len(files)} files.")
+        # ZipFile.write copies in 8 KiB reads; copy in 1 MiB chunks instead
+        zinfo = zipfile.ZipInfo.from_file(file_path, unique_arcname(zipf, file_path.name))
+        zinfo.compress_type = zipfile.ZIP_STORED
+        with open(file_path, "rb") as src, zipf.open(zinfo, "w") as dst:
+            shutil.copyfileobj(src, dst, ZIP_CHUNK_SIZE)
+        logging.info(f"Added {file_path.name} to zip as {zinfo.filename}.")
     except Exception as e:
-        logging.error(f"Failed to create zip file at {zip_path}: {e}")
+        logging.error(f"Failed to add {file_path.name} to zip: {e}")
         raise
 
 
+def unique_arcname(zipf: zipfile.ZipFile, name: str) -> str:
+    """Return name, numbered like "video (1).mp4" if zipf already has an entry by that name."""
+    names = set(zipf.namelist())
+    stem, suffix = os.path.splitext(name)
+    arcname, n = name, 1
+    while arcname in names:
+        arcname = f"{stem} ({n}){suffix}"
+        n += 1
+    return arcname
+
+
 def call_webhook(webhook_url: str, data: dict) -> None:
     """Call the webhook with the result data."""
     try: